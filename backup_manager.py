@@ -0,0 +1,119 @@
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+# 1ステップでコピーするページ数（ステップの間に他のスレッドへ処理を譲る）
+BACKUP_PAGES_PER_STEP = 64
+BACKUP_STEP_SLEEP = 0.005
+# データベースごとに残すスナップショットの数
+BACKUP_KEEP = 7
+BACKUP_INTERVAL_HOURS = 6
+
+def _db_stem(db_path: str) -> str:
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+def check_integrity(db_path: str) -> bool:
+    """PRAGMA integrity_check が ok を返すか"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0] == "ok"
+    finally:
+        conn.close()
+
+def backup_database(db_path: str, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> Dict:
+    """稼働中のデータベースをオンラインバックアップAPIで圧縮スナップショットにする
+
+    コピー先は一時ファイルで、整合性チェックに通ったものだけを gzip 圧縮して
+    backup_dir に置き、古いスナップショットは keep 個を残して削除する。
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    started = time.perf_counter()
+    name = f"{_db_stem(db_path)}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.db.gz"
+    snapshot_path = os.path.join(backup_dir, name)
+    partial_path = snapshot_path + ".tmp"
+
+    fd, tmp_path = tempfile.mkstemp(suffix=".db", dir=backup_dir)
+    os.close(fd)
+    try:
+        src = sqlite3.connect(db_path, isolation_level=None)
+        dst = sqlite3.connect(tmp_path)
+        try:
+            # 読み取りトランザクションを張ったままコピーすると、途中で他の接続が書き込んでも
+            # 最初からやり直しにならず、開始時点のスナップショットが取れる
+            # （WALモードなので読み取り中も書き込みは止まらない）
+            src.execute("BEGIN")
+            src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+            src.backup(dst, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP)
+            src.execute("COMMIT")
+        finally:
+            dst.close()
+            src.close()
+
+        if not check_integrity(tmp_path):
+            raise sqlite3.DatabaseError(f"整合性チェックに失敗しました: {db_path}")
+
+        with open(tmp_path, "rb") as f_in, gzip.open(partial_path, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        os.replace(partial_path, snapshot_path)
+    finally:
+        os.remove(tmp_path)
+        # 圧縮の途中で失敗した場合の書きかけ（list_snapshots に載らないのでここで消す）
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    for old_path in list_snapshots(db_path, backup_dir)[keep:]:
+        os.remove(old_path)
+
+    return {
+        'path': snapshot_path,
+        'size': os.path.getsize(snapshot_path),
+        'duration': time.perf_counter() - started
+    }
+
+def list_snapshots(db_path: str, backup_dir: str = BACKUP_DIR) -> List[str]:
+    """スナップショットを新しい順に取得"""
+    pattern = os.path.join(backup_dir, f"{_db_stem(db_path)}-*.db.gz")
+    return sorted(glob.glob(pattern), reverse=True)
+
+def find_snapshot(db_path: str, name: Optional[str] = None, backup_dir: str = BACKUP_DIR) -> Optional[str]:
+    """ファイル名からスナップショットを探す（省略時は最新）"""
+    snapshots = list_snapshots(db_path, backup_dir)
+    if name is None:
+        return snapshots[0] if snapshots else None
+    for path in snapshots:
+        if os.path.basename(path) == name:
+            return path
+    return None
+
+def restore_database(snapshot_path: str, db_path: str):
+    """スナップショットを稼働中のデータベースへ書き戻す
+
+    展開したスナップショットの整合性を確認してから、バックアップAPIで
+    一度にコピーするので、他の接続からは復元前か復元後のどちらかしか見えない。
+    """
+    backup_dir = os.path.dirname(snapshot_path) or "."
+    fd, tmp_path = tempfile.mkstemp(suffix=".db", dir=backup_dir)
+    os.close(fd)
+    try:
+        with gzip.open(snapshot_path, "rb") as f_in, open(tmp_path, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+
+        if not check_integrity(tmp_path):
+            raise sqlite3.DatabaseError(f"スナップショットが壊れています: {snapshot_path}")
+
+        src = sqlite3.connect(tmp_path)
+        dst = sqlite3.connect(db_path, timeout=30)
+        try:
+            src.backup(dst)
+        finally:
+            dst.close()
+            src.close()
+    finally:
+        os.remove(tmp_path)
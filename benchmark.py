@@ -0,0 +1,117 @@
+"""ベンチマーク用のデータ生成と計測
+
+    python benchmark.py --records 200000 backup
+
+で一時ディレクトリに対戦記録を生成し、バックアップの所要時間と、
+バックアップ中のコマンド相当のクエリのレイテンシを計測する。
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from backup_manager import backup_database
+from database_manager import DatabaseManager
+
+DECKS = [
+    'AFネメシス', '人形ネメシス', 'スペブウィッチ', '秘術ウィッチ', 'ランプドラゴン', '疾走ドラゴン',
+    'ミッドレンジロイヤル', 'アミュレットビショップ', 'アグロナイトメア', '妖精エルフ'
+]
+MEMO_WORDS = ['オメガドライブ', '機構解放', '2T目', 'マリガン', '事故', 'リーサル', '除去', '進化', '超進化', 'ミス']
+
+def generate_records(db_path: str, count: int, players: int = 200, seed: int = 0):
+    """ランダムな対戦記録を count 件追加する"""
+    DatabaseManager(db_path)  # テーブル作成
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1)
+
+    rows = []
+    for i in range(count):
+        player = rng.randrange(players)
+        memo = " ".join(rng.sample(MEMO_WORDS, 2)) if rng.random() < 0.3 else ""
+        rows.append((
+            (start + timedelta(seconds=i * 60)).strftime("%Y-%m-%d %H:%M:%S"),
+            f"player{player}", str(100000000000000000 + player),
+            rng.choice(['勝ち', '負け']), rng.choice(DECKS), rng.choice(DECKS),
+            rng.choice(['先攻', '後攻']), memo
+        ))
+
+    conn = sqlite3.connect(db_path)
+    conn.executemany('''
+    INSERT INTO game_records (timestamp, player_name, player_id, result, my_deck, opponent_deck, turn_order, memo)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100))]
+
+def format_latencies(label, samples):
+    return (f"{label}: n={len(samples)} p50={statistics.median(samples) * 1000:.2f}ms "
+            f"p95={percentile(samples, 95) * 1000:.2f}ms p99={percentile(samples, 99) * 1000:.2f}ms "
+            f"max={max(samples) * 1000:.2f}ms")
+
+def run_commands(db_manager, stop, reads, writes):
+    """!recent / !stats 相当の読み取りと !record 相当の書き込みを stop まで繰り返す"""
+    rng = random.Random(1)
+    while not stop.is_set():
+        player_id = 100000000000000000 + rng.randrange(200)
+
+        started = time.perf_counter()
+        db_manager.get_recent_records_page(10, player_id=player_id)
+        db_manager.get_user_stats(player_id)
+        reads.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        db_manager.add_record("bench", player_id, rng.choice(['勝ち', '負け']),
+                              rng.choice(DECKS), rng.choice(DECKS), '先攻')
+        writes.append(time.perf_counter() - started)
+
+def bench_backup(db_path: str, backup_dir: str, duration: float):
+    db_manager = DatabaseManager(db_path)
+
+    # バックアップなしの基準値
+    stop = threading.Event()
+    base_reads, base_writes = [], []
+    timer = threading.Timer(duration, stop.set)
+    timer.start()
+    run_commands(db_manager, stop, base_reads, base_writes)
+
+    # バックアップと並行して計測
+    stop = threading.Event()
+    reads, writes = [], []
+    worker = threading.Thread(target=run_commands, args=(db_manager, stop, reads, writes))
+    worker.start()
+    result = backup_database(db_path, backup_dir)
+    stop.set()
+    worker.join()
+
+    print(f"DBサイズ: {os.path.getsize(db_path) / 1024 / 1024:.1f} MB")
+    print(f"バックアップ: {result['duration']:.2f}秒 → {result['size'] / 1024 / 1024:.1f} MB（圧縮後）")
+    print(format_latencies("読み取り（基準）", base_reads))
+    print(format_latencies("読み取り（バックアップ中）", reads))
+    print(format_latencies("書き込み（基準）", base_writes))
+    print(format_latencies("書き込み（バックアップ中）", writes))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=200000, help="生成する対戦記録の件数")
+    parser.add_argument("--duration", type=float, default=3.0, help="基準値を計測する秒数")
+    parser.add_argument("target", choices=["backup"], help="計測する対象")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "game_records.db")
+        generate_records(db_path, args.records)
+        if args.target == "backup":
+            bench_backup(db_path, os.path.join(tmp_dir, "backups"), args.duration)
+
+if __name__ == "__main__":
+    main()
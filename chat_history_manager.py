@@ -1,10 +1,13 @@
 import sqlite3
+from search_utils import FTS_TOKENIZE, build_match_query, build_like_patterns
 
 DB_NAME = "chat_history.db"
 
 def init_db():
     conn = sqlite3.connect(DB_NAME)
     c = conn.cursor()
+    # WALモードにしておくと、バックアップなどの読み取り中でも書き込みが止まらない
+    c.execute("PRAGMA journal_mode=WAL")
     c.execute('''
         CREATE TABLE IF NOT EXISTS chat_history (
             player_id TEXT,
@@ -13,6 +16,31 @@ def init_db():
             timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_player ON chat_history (player_id, timestamp)")
+
+    # 会話内容の全文検索用インデックス（chat_historyを外部コンテンツとして参照し、トリガーで同期）
+    c.execute("SELECT 1 FROM sqlite_master WHERE name = 'chat_history_fts'")
+    fts_exists = c.fetchone() is not None
+    c.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5(
+            content, content='chat_history', tokenize='{FTS_TOKENIZE}'
+        )
+    ''')
+    c.executescript('''
+        CREATE TRIGGER IF NOT EXISTS chat_history_fts_insert AFTER INSERT ON chat_history BEGIN
+            INSERT INTO chat_history_fts (rowid, content) VALUES (new.rowid, new.content);
+        END;
+        CREATE TRIGGER IF NOT EXISTS chat_history_fts_delete AFTER DELETE ON chat_history BEGIN
+            INSERT INTO chat_history_fts (chat_history_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+        END;
+        CREATE TRIGGER IF NOT EXISTS chat_history_fts_update AFTER UPDATE OF content ON chat_history BEGIN
+            INSERT INTO chat_history_fts (chat_history_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+            INSERT INTO chat_history_fts (rowid, content) VALUES (new.rowid, new.content);
+        END;
+    ''')
+    if not fts_exists:
+        c.execute("INSERT INTO chat_history_fts (chat_history_fts) VALUES ('rebuild')")
+
     conn.commit()
     conn.close()
 
@@ -43,3 +71,28 @@ def delete_history(player_id):
     c.execute("DELETE FROM chat_history WHERE player_id = ?", (str(player_id),))
     conn.commit()
     conn.close()
+
+def search_history(player_id, query, limit=10, offset=0):
+    """自分の会話履歴を全文検索（関連度順）し、(結果リスト, 続きがあるか) を返す
+
+    索引を使うため、3文字以上の語を1つ以上含まない検索は結果なしを返す。
+    """
+    match = build_match_query(query)
+    if match is None:
+        return [], False
+    # 短い語はMATCHで絞り込んだ行にだけLIKEを適用する
+    patterns = build_like_patterns(query)
+    like = "".join(" AND h.content LIKE ? ESCAPE '\\'" for _ in patterns)
+    conn = sqlite3.connect(DB_NAME)
+    c = conn.cursor()
+    c.execute(
+        f"""SELECT h.role, snippet(chat_history_fts, 0, '**', '**', '…', 32), h.timestamp
+            FROM chat_history_fts JOIN chat_history h ON h.rowid = chat_history_fts.rowid
+            WHERE chat_history_fts MATCH ? AND h.player_id = ?{like}
+            ORDER BY chat_history_fts.rank LIMIT ? OFFSET ?""",
+        (match, str(player_id), *patterns, limit + 1, offset)
+    )
+    rows = c.fetchall()
+    conn.close()
+    results = [{"role": role, "content": content, "timestamp": timestamp} for role, content, timestamp in rows[:limit]]
+    return results, len(rows) > limit
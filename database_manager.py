@@ -1,18 +1,37 @@
+import asyncio
 import sqlite3
 import os
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
+from leaderboard import RatingManager
+from response_cache import ResponseCache
+from search_utils import FTS_TOKENIZE, build_match_query, build_like_patterns
+
+# Embedのフィールド上限（25）を超える件数は表示できないので1ページの上限とする
+MAX_PAGE_SIZE = 25
 
 class DatabaseManager:
     def __init__(self, db_path="game_records.db"):
         self.db_path = db_path
+        self.ratings = RatingManager()
+        # 読み取りコマンドの結果キャッシュ（書き込み時に 'records' / 'decks' の世代を進める）
+        self.cache = ResponseCache()
+        # ランキングを別スレッドで再構築している間に追加された記録 [(ID, 記録)]
+        self._pending_records = None
+        # reset_records のたびに進める（再構築中にリセットされたかの判定用）
+        self._ratings_epoch = 0
+        self._reload_lock = asyncio.Lock()
         self.init_database()
+        self.load_ratings()
     
     def init_database(self):
         """データベースとテーブルを初期化"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # WALモードにしておくと、バックアップなどの読み取り中でも書き込みが止まらない
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # デッキテーブル作成（シンプル化）
         cursor.execute('''
         CREATE TABLE IF NOT EXISTS decks (
@@ -36,6 +55,36 @@ class DatabaseManager:
         )
         ''')
         
+        # 最近の記録をキーセット（timestamp, id）でページングするためのインデックス
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_time ON game_records (timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_player_time ON game_records (player_id, timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_deck_time ON game_records (my_deck, timestamp, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_records_player_deck_time ON game_records (player_id, my_deck, timestamp, id)')
+        
+        # メモの全文検索用インデックス（game_recordsを外部コンテンツとして参照し、トリガーで同期）
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'game_records_fts'")
+        fts_exists = cursor.fetchone() is not None
+        cursor.execute(f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS game_records_fts USING fts5(
+            memo, content='game_records', content_rowid='id', tokenize='{FTS_TOKENIZE}'
+        )
+        ''')
+        cursor.executescript('''
+        CREATE TRIGGER IF NOT EXISTS game_records_fts_insert AFTER INSERT ON game_records BEGIN
+            INSERT INTO game_records_fts (rowid, memo) VALUES (new.id, new.memo);
+        END;
+        CREATE TRIGGER IF NOT EXISTS game_records_fts_delete AFTER DELETE ON game_records BEGIN
+            INSERT INTO game_records_fts (game_records_fts, rowid, memo) VALUES ('delete', old.id, old.memo);
+        END;
+        CREATE TRIGGER IF NOT EXISTS game_records_fts_update AFTER UPDATE OF memo ON game_records BEGIN
+            INSERT INTO game_records_fts (game_records_fts, rowid, memo) VALUES ('delete', old.id, old.memo);
+            INSERT INTO game_records_fts (rowid, memo) VALUES (new.id, new.memo);
+        END;
+        ''')
+        if not fts_exists:
+            # 既存の記録を索引に取り込む
+            cursor.execute("INSERT INTO game_records_fts (game_records_fts) VALUES ('rebuild')")
+        
         # サンプルデッキデータを挿入（まだデータがない場合のみ）
         cursor.execute('SELECT COUNT(*) FROM decks')
         if cursor.fetchone()[0] == 0:
@@ -53,8 +102,63 @@ class DatabaseManager:
         conn.commit()
         conn.close()
     
+    def build_ratings(self) -> Tuple[RatingManager, int]:
+        """全対戦記録を古い順に読み込んでランキングを作り、(ランキング, 読み込んだ最大ID) を返す"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+        SELECT id, player_name, player_id, result, my_deck, opponent_deck
+        FROM game_records
+        ORDER BY timestamp, id
+        ''')
+        
+        last_id = 0
+        def rows():
+            nonlocal last_id
+            for row in cursor:
+                last_id = max(last_id, row[0])
+                yield row[1:]
+        
+        ratings = RatingManager()
+        ratings.rebuild(rows())
+        
+        conn.close()
+        return ratings, last_id
+    
+    def load_ratings(self):
+        """全対戦記録からランキングを再構築（起動時用）"""
+        self.ratings, _ = self.build_ratings()
+    
+    async def reload_ratings(self):
+        """イベントループを止めないよう、別スレッドで再構築したランキングに差し替える"""
+        async with self._reload_lock:
+            self._pending_records = []
+            epoch = self._ratings_epoch
+            try:
+                ratings, last_id = await asyncio.to_thread(self.build_ratings)
+                if epoch != self._ratings_epoch:
+                    # 再構築中にリセットされた
+                    ratings, last_id = RatingManager(), 0
+                # 読み込みに間に合わなかった記録を追加する
+                for record_id, record in self._pending_records:
+                    if record_id > last_id:
+                        ratings.apply_record(*record)
+                self.ratings = ratings
+            finally:
+                self._pending_records = None
+    
+    async def refresh(self):
+        """データベースファイルを外部で書き換えた（バックアップから復元した）後に呼ぶ"""
+        self.cache.bump('records', 'decks')
+        await self.reload_ratings()
+    
     def get_deck_list(self) -> List[str]:
         """デッキリストを取得（デッキ名のみ）"""
+        # セレクトメニューを作るたびに呼ばれるので、デッキの追加・削除まではキャッシュを使う
+        return list(self.cache.get_or_build(('deck_list',), ('decks',), self._load_deck_list))
+    
+    def _load_deck_list(self) -> List[str]:
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
@@ -79,8 +183,15 @@ class DatabaseManager:
             VALUES (?, ?, ?, ?, ?, ?, ?, ?)
             ''', (timestamp, user_name, str(user_id), result, my_deck, opponent_deck, turn_order, memo))
             
+            record_id = cursor.lastrowid
             conn.commit()
             conn.close()
+            
+            record = (user_name, user_id, result, my_deck, opponent_deck)
+            self.ratings.apply_record(*record)
+            if self._pending_records is not None:
+                self._pending_records.append((record_id, record))
+            self.cache.bump('records')
             return True
         except Exception as e:
             print(f"記録追加エラー: {e}")
@@ -124,6 +235,7 @@ class DatabaseManager:
                 cursor = conn.cursor()
                 cursor.execute("INSERT INTO decks (deck_name) VALUES (?)", (deck_name,))
                 conn.commit()
+            self.cache.bump('decks')
             print(f"デッキ追加成功: {deck_name}")
             return True
         except sqlite3.IntegrityError as e:
@@ -148,6 +260,9 @@ class DatabaseManager:
             
             conn.commit()
             conn.close()
+            
+            if deleted_rows > 0:
+                self.cache.bump('decks')
             return deleted_rows > 0
         except Exception as e:
             print(f"デッキ削除エラー: {e}")
@@ -163,35 +278,204 @@ class DatabaseManager:
             
             conn.commit()
             conn.close()
+            
+            self.ratings.clear()
+            self._ratings_epoch += 1
+            if self._pending_records is not None:
+                self._pending_records.clear()
+            self.cache.bump('records')
             return True
         except Exception as e:
             print(f"記録リセットエラー: {e}")
             return False
     
-    def get_recent_records(self, limit: int = 10) -> List[Dict]:
-        """最近の対戦記録を取得"""
+    def reset_own_records(self, user_id: int) -> int:
+        """指定ユーザーの対戦記録のみ削除し、削除件数を返す
+
+        デッキのレートは記録の順序に依存するので、削除後は reload_ratings() で全体を再計算すること。
+        """
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        cursor.execute('DELETE FROM game_records WHERE player_id = ?', (str(user_id),))
+        deleted_rows = cursor.rowcount
+        
+        conn.commit()
+        conn.close()
+        
+        if deleted_rows > 0:
+            # 再計算が終わるまでの間も、本人はランキングから外しておく
+            self.ratings.players.remove(str(user_id))
+            self.cache.bump('records')
+        return deleted_rows
+    
+    def get_matchup_stats(self, user_id: int, my_deck: str) -> Dict[str, Dict[str, int]]:
+        """指定デッキでの相手デッキ毎の勝敗数を取得"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
         cursor.execute('''
-        SELECT timestamp, player_name, result, my_deck, opponent_deck, turn_order
+        SELECT opponent_deck, result
         FROM game_records
-        ORDER BY timestamp DESC
-        LIMIT ?
-        ''', (limit,))
+        WHERE player_id = ? AND my_deck = ?
+        ''', (str(user_id), my_deck))
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        deck_stats = {}
+        for opponent, result in rows:
+            deck_stats.setdefault(opponent, {"勝ち": 0, "負け": 0})
+            if result in deck_stats[opponent]:
+                deck_stats[opponent][result] += 1
+        return deck_stats
+    
+    def get_opponent_deck_counts(self) -> Dict[str, int]:
+        """相手デッキ毎の対戦数を取得"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
         
+        cursor.execute('SELECT opponent_deck, COUNT(*) FROM game_records GROUP BY opponent_deck')
         rows = cursor.fetchall()
         
+        conn.close()
+        return dict(rows)
+    
+    def _leaderboard(self, target: str):
+        return self.ratings.players if target == 'player' else self.ratings.decks
+    
+    def get_leaderboard(self, target: str, kind: str, limit: int = 10) -> List[Dict]:
+        """ランキング上位を取得（target は 'player' か 'deck'、kind は 'winrate' / 'games' / 'rating'）"""
+        board = self._leaderboard(target)
+        return board.top(kind, max(1, min(int(limit), MAX_PAGE_SIZE)))
+    
+    def get_rank(self, target: str, kind: str, member) -> Tuple[Optional[int], int]:
+        """順位と、そのランキングの参加数を取得"""
+        board = self._leaderboard(target)
+        return board.rank(kind, str(member)), board.size(kind)
+    
+    def get_rating_summary(self, target: str, member) -> Optional[Dict]:
+        """プレイヤーまたはデッキの戦績とレートを取得"""
+        board = self._leaderboard(target)
+        member = str(member)
+        return board.summary(member) if member in board.entries else None
+    
+    def search_memos(self, query: str, limit: int = 10, offset: int = 0) -> Tuple[List[Dict], bool]:
+        """メモを全文検索（関連度順）し、(記録リスト, 続きがあるか) を返す
+
+        索引を使うため、3文字以上の語を1つ以上含まない検索は結果なしを返す。
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        match = build_match_query(query)
+        if match is None:
+            return [], False
+        
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        
+        # 短い語はMATCHで絞り込んだ行にだけLIKEを適用する
+        patterns = build_like_patterns(query)
+        like = "".join(" AND r.memo LIKE ? ESCAPE '\\'" for _ in patterns)
+        cursor.execute(f'''
+        SELECT r.id, r.timestamp, r.player_name, r.result, r.my_deck, r.opponent_deck, r.turn_order,
+               snippet(game_records_fts, 0, '**', '**', '…', 32)
+        FROM game_records_fts
+        JOIN game_records r ON r.id = game_records_fts.rowid
+        WHERE game_records_fts MATCH ?{like}
+        ORDER BY game_records_fts.rank
+        LIMIT ? OFFSET ?
+        ''', (match, *patterns, limit + 1, offset))
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
         records = []
-        for row in rows:
+        for row in rows[:limit]:
             records.append({
-                '日時': row[0],
-                'プレイヤー': row[1],
-                '勝敗': row[2],
-                '自分デッキ': row[3],
-                '相手デッキ': row[4],
-                '先攻後攻': row[5]
+                'ID': row[0],
+                '日時': row[1],
+                'プレイヤー': row[2],
+                '勝敗': row[3],
+                '自分デッキ': row[4],
+                '相手デッキ': row[5],
+                '先攻後攻': row[6],
+                'メモ': row[7]
             })
         
-        conn.close()
+        return records, len(rows) > limit
+    
+    def get_recent_records(self, limit: int = 10) -> List[Dict]:
+        """最近の対戦記録を取得"""
+        records, _, _ = self.get_recent_records_page(limit)
         return records
+
+    def get_recent_records_page(self, page_size: int = 10, player_id: Optional[int] = None,
+                                deck: Optional[str] = None, before: Optional[Tuple[str, int]] = None,
+                                after: Optional[Tuple[str, int]] = None) -> Tuple[List[Dict], bool, bool]:
+        """最近の対戦記録を1ページ分取得（新しい順）
+
+        before / after には (日時, ID) のカーソルを渡す。
+        before を渡すとそれより古いページ、after を渡すとそれより新しいページを返す。
+        OFFSET を使わないので、どれだけ古いページでも先頭ページと同じコストで取得できる。
+        戻り値は (記録リスト, より新しい記録があるか, より古い記録があるか)。
+        """
+        page_size = max(1, min(int(page_size), MAX_PAGE_SIZE))
+
+        conditions = []
+        params = []
+        if player_id:
+            conditions.append('player_id = ?')
+            params.append(str(player_id))
+        if deck:
+            conditions.append('my_deck = ?')
+            params.append(deck)
+
+        if after is not None:
+            conditions.append('(timestamp, id) > (?, ?)')
+            params.extend(after)
+            order = 'ASC'
+        else:
+            if before is not None:
+                conditions.append('(timestamp, id) < (?, ?)')
+                params.extend(before)
+            order = 'DESC'
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        # 1件多く取得して次のページの有無を判定する
+        cursor.execute(f'''
+        SELECT id, timestamp, player_name, result, my_deck, opponent_deck, turn_order
+        FROM game_records
+        {where}
+        ORDER BY timestamp {order}, id {order}
+        LIMIT ?
+        ''', (*params, page_size + 1))
+
+        rows = cursor.fetchall()
+        conn.close()
+
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+
+        if after is not None:
+            rows.reverse()
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = before is not None, has_more
+
+        records = []
+        for row in rows:
+            records.append({
+                'ID': row[0],
+                '日時': row[1],
+                'プレイヤー': row[2],
+                '勝敗': row[3],
+                '自分デッキ': row[4],
+                '相手デッキ': row[5],
+                '先攻後攻': row[6]
+            })
+
+        return records, has_newer, has_older
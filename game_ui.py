@@ -1,7 +1,8 @@
 
+import asyncio
 import discord
-import sqlite3
 from discord.ui import Select, View, Button
+from backup_manager import restore_database
 
 class GameRecordView(View):
     def __init__(self, db_manager):
@@ -11,6 +12,7 @@ class GameRecordView(View):
         self.my_deck = None
         self.opponent_deck = None
         self.turn_order = None
+        self.memo = ""
     
     @discord.ui.button(label="勝ち", style=discord.ButtonStyle.success, emoji="🏆")
     async def win_button(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -81,6 +83,10 @@ class TurnOrderView(View):
         self.parent_view.turn_order = "後攻"
         await self.save_record(interaction)
 
+    @discord.ui.button(label="メモを入力", style=discord.ButtonStyle.secondary, emoji="📝")
+    async def memo_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_modal(MemoModal(self.parent_view))
+
     async def save_record(self, interaction):
         # SQLiteに記録を保存
         success = self.db_manager.add_record(
@@ -89,7 +95,8 @@ class TurnOrderView(View):
             result=self.parent_view.result,
             my_deck=self.parent_view.my_deck,
             opponent_deck=self.parent_view.opponent_deck,
-            turn_order=self.parent_view.turn_order
+            turn_order=self.parent_view.turn_order,
+            memo=self.parent_view.memo
         )
         
         if success:
@@ -98,12 +105,27 @@ class TurnOrderView(View):
             embed.add_field(name="自分のデッキ", value=self.parent_view.my_deck, inline=True)
             embed.add_field(name="相手のデッキ", value=self.parent_view.opponent_deck, inline=True)
             embed.add_field(name="先攻・後攻", value=self.parent_view.turn_order, inline=True)
+            if self.parent_view.memo:
+                embed.add_field(name="メモ", value=self.parent_view.memo, inline=False)
             embed.set_footer(text="記録がSQLiteデータベースに保存されました")
             
             await interaction.response.send_message(embed=embed, ephemeral=True)
         else:
             await interaction.response.send_message("❌ 記録の保存に失敗しました。管理者に連絡してください。", ephemeral=True)
 
+class MemoModal(discord.ui.Modal, title="対戦メモ"):
+    def __init__(self, parent_view):
+        super().__init__()
+        self.parent_view = parent_view
+        self.memo.default = parent_view.memo or None
+
+    memo = discord.ui.TextInput(label="メモ", style=discord.TextStyle.paragraph, required=False, max_length=500,
+                                placeholder="キーになったカードや展開など（後で !search で検索できるよ）")
+
+    async def on_submit(self, interaction: discord.Interaction):
+        self.parent_view.memo = self.memo.value.strip()
+        await interaction.response.send_message("📝 メモを設定したよ！先攻・後攻を選ぶと保存されるよ", ephemeral=True)
+
 class DeckManageView(View):
     def __init__(self, db_manager):
         super().__init__(timeout=300)
@@ -195,6 +217,53 @@ class ResetRecordsView(View):
     async def cancel_reset(self, interaction: discord.Interaction, button: discord.ui.Button):
         await interaction.response.send_message("リセットをキャンセルしました。", ephemeral=True)
 
+def build_rate_embed(db_manager, player_id, selected_deck, display_name):
+    """指定デッキの相手デッキ毎の勝率Embedを作成（記録がなければ None）"""
+    deck_stats = db_manager.get_matchup_stats(player_id, selected_deck)
+    if not deck_stats:
+        return None
+
+    # 整形
+    result_lines = []
+    for opponent, result in deck_stats.items():
+        total = result["勝ち"] + result["負け"]
+        win_rate = (result["勝ち"] / total) * 100 if total > 0 else 0
+        result_lines.append(f"vs **{opponent}**：{total}戦 {result['勝ち']}勝（勝率 {win_rate:.1f}%）")
+
+    return discord.Embed(
+        title=f"📊 {display_name} のデッキ「{selected_deck}」対戦統計",
+        description="\n".join(result_lines),
+        color=0x00ccff
+    )
+
+class RestoreView(View):
+    def __init__(self, db_manager, snapshot_path, db_path):
+        super().__init__(timeout=300)
+        self.db_manager = db_manager
+        self.snapshot_path = snapshot_path
+        self.db_path = db_path
+
+    @discord.ui.button(label="復元する", style=discord.ButtonStyle.danger, emoji="⚠️")
+    async def confirm_restore(self, interaction: discord.Interaction, button: discord.ui.Button):
+        if not interaction.user.guild_permissions.administrator:
+            await interaction.response.send_message("❌ この機能は管理者のみが使用できます。", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        try:
+            await asyncio.to_thread(restore_database, self.snapshot_path, self.db_path)
+        except Exception as e:
+            await interaction.followup.send(f"❌ 復元に失敗しました: {e}", ephemeral=True)
+            return
+
+        if self.db_path == self.db_manager.db_path:
+            await self.db_manager.refresh()
+        await interaction.followup.send("✅ スナップショットから復元しました", ephemeral=True)
+
+    @discord.ui.button(label="キャンセル", style=discord.ButtonStyle.secondary, emoji="❌")
+    async def cancel_restore(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await interaction.response.send_message("復元をキャンセルしました。", ephemeral=True)
+
 class RateDeckSelectView(View):
     def __init__(self, db_manager, player_id):
         super().__init__(timeout=300)
@@ -229,39 +298,145 @@ class RateDeckSelect(Select):
             await interaction.response.send_message("デッキが見つからないよ", ephemeral=True)
             return
 
-        conn = sqlite3.connect("game_records.db")
-        cursor = conn.cursor()
+        embed = self.db_manager.cache.get_or_build(
+            ("rate", self.player_id, selected_deck, interaction.user.display_name), ("records",),
+            lambda: build_rate_embed(self.db_manager, self.player_id, selected_deck, interaction.user.display_name))
 
-        cursor.execute('''
-            SELECT opponent_deck, result
-            FROM game_records
-            WHERE player_id = ? AND my_deck = ?
-        ''', (str(self.player_id), selected_deck))
+        if embed is None:
+            await interaction.response.send_message(f"デッキ **{selected_deck}** の対戦記録はまだないよ！", ephemeral=True)
+            return
 
-        rows = cursor.fetchall()
-        conn.close()
+        await interaction.response.send_message(embed=embed, ephemeral=True)
 
-        if not rows:
-            await interaction.response.send_message(f"デッキ **{selected_deck}** の対戦記録はまだないよ！", ephemeral=True)
+def build_recent_embed(records, title="📝 最近の対戦記録", offset=0):
+    """最近の対戦記録のEmbedを作成（offset はこのページより新しい記録の件数）"""
+    embed = discord.Embed(title=title, color=0x0099ff)
+
+    for i, record in enumerate(records, offset + 1):
+        result_emoji = "️⭕️" if record['勝敗'] == "勝ち" else "❌"
+        turn_emoji = "2️⃣" if record['先攻後攻'] == "先攻" else "1️⃣"
+
+        field_name = f"{i}. {record['プレイヤー']} {result_emoji}"
+        field_value = f"{record['自分デッキ']} vs {record['相手デッキ']} {turn_emoji}\n{record['日時']}"
+
+        embed.add_field(name=field_name, value=field_value, inline=False)
+
+    return embed
+
+# Embedのタイトル上限は256文字なので、検索語はこの長さで切る
+MAX_QUERY_TITLE_LENGTH = 200
+
+def shorten_query(query):
+    if len(query) <= MAX_QUERY_TITLE_LENGTH:
+        return query
+    return query[:MAX_QUERY_TITLE_LENGTH - 1] + "…"
+
+def build_memo_search_embed(query, records, page=0):
+    """メモ検索結果のEmbedを作成"""
+    embed = discord.Embed(title=f"🔍 メモ検索：{shorten_query(query)}", color=0x0099ff)
+
+    for record in records:
+        result_emoji = "️⭕️" if record['勝敗'] == "勝ち" else "❌"
+        field_name = f"{record['プレイヤー']} {result_emoji} {record['自分デッキ']} vs {record['相手デッキ']}"
+        field_value = f"{record['メモ']}\n{record['日時']}"
+        embed.add_field(name=field_name, value=field_value[:1024], inline=False)
+
+    embed.set_footer(text=f"{page + 1}ページ目")
+    return embed
+
+def build_chat_search_embed(query, results, page=0):
+    """会話履歴検索結果のEmbedを作成"""
+    role_map = {"user": "あなた", "assistant": "ララミア"}
+    embed = discord.Embed(title=f"🔍 会話履歴検索：{shorten_query(query)}", color=0x0099ff)
+
+    for result in results:
+        field_name = f"{role_map.get(result['role'], result['role'])}（{result['timestamp']}）"
+        embed.add_field(name=field_name, value=result['content'][:1024], inline=False)
+
+    embed.set_footer(text=f"{page + 1}ページ目")
+    return embed
+
+class RecentRecordsView(View):
+    """最近の対戦記録を前後のページへ移動するボタン"""
+    def __init__(self, db_manager, records, has_newer, has_older, page_size, player_id=None, deck=None, title="📝 最近の対戦記録"):
+        super().__init__(timeout=300)
+        self.db_manager = db_manager
+        self.page_size = page_size
+        self.player_id = player_id
+        self.deck = deck
+        self.title = title
+        # 表示中のページより新しい記録の件数（通し番号用）
+        self.offset = 0
+        self.records = records
+        self.set_page(records, has_newer, has_older)
+
+    def set_page(self, records, has_newer, has_older):
+        # ページの先頭と末尾の (日時, ID) を次のページ取得のカーソルにする
+        self.first = (records[0]['日時'], records[0]['ID'])
+        self.last = (records[-1]['日時'], records[-1]['ID'])
+        self.newer_button.disabled = not has_newer
+        self.older_button.disabled = not has_older
+
+    async def show_page(self, interaction, before=None, after=None):
+        records, has_newer, has_older = self.db_manager.get_recent_records_page(
+            self.page_size, player_id=self.player_id, deck=self.deck, before=before, after=after)
+
+        if not records:
+            # 表示中に記録が削除された場合など
+            self.newer_button.disabled = after is not None
+            self.older_button.disabled = before is not None
+            await interaction.response.edit_message(view=self)
             return
 
-        # 集計
-        from collections import defaultdict
-        deck_stats = defaultdict(lambda: {"勝ち": 0, "負け": 0})
-        for opponent, result in rows:
-            deck_stats[opponent][result] += 1
-
-        # 整形
-        result_lines = []
-        for opponent, result in deck_stats.items():
-            total = result["勝ち"] + result["負け"]
-            win_rate = (result["勝ち"] / total) * 100 if total > 0 else 0
-            result_lines.append(f"vs **{opponent}**：{total}戦 {result['勝ち']}勝（勝率 {win_rate:.1f}%）")
-
-        embed = discord.Embed(
-            title=f"📊 {interaction.user.display_name} のデッキ「{selected_deck}」対戦統計",
-            description="\n".join(result_lines),
-            color=0x00ccff
-        )
+        if before is not None:
+            self.offset += len(self.records)
+        else:
+            self.offset = max(self.offset - len(records), 0)
+        # 先頭ページに戻ったら、間に追加された記録があっても 1 から数え直す
+        if not has_newer:
+            self.offset = 0
+        self.records = records
+        self.set_page(records, has_newer, has_older)
+        await interaction.response.edit_message(embed=build_recent_embed(records, self.title, self.offset), view=self)
+
+    @discord.ui.button(label="新しい記録", style=discord.ButtonStyle.secondary, emoji="◀️")
+    async def newer_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, after=self.first)
+
+    @discord.ui.button(label="古い記録", style=discord.ButtonStyle.secondary, emoji="▶️")
+    async def older_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, before=self.last)
+
+class SearchResultsView(View):
+    """検索結果のページを前後に移動するボタン"""
+    def __init__(self, search, build_embed, query, page_size, has_next):
+        super().__init__(timeout=300)
+        self.search = search
+        self.build_embed = build_embed
+        self.query = query
+        self.page_size = page_size
+        self.page = 0
+        self.update_buttons(has_next)
+
+    def update_buttons(self, has_next):
+        self.prev_button.disabled = self.page == 0
+        self.next_button.disabled = not has_next
+
+    async def show_page(self, interaction, page):
+        results, has_next = self.search(self.query, self.page_size, page * self.page_size)
+        if not results:
+            self.next_button.disabled = True
+            await interaction.response.edit_message(view=self)
+            return
 
-        await interaction.response.send_message(embed=embed, ephemeral=True)
+        self.page = page
+        self.update_buttons(has_next)
+        await interaction.response.edit_message(embed=self.build_embed(self.query, results, page), view=self)
+
+    @discord.ui.button(label="前へ", style=discord.ButtonStyle.secondary, emoji="◀️")
+    async def prev_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, max(self.page - 1, 0))
+
+    @discord.ui.button(label="次へ", style=discord.ButtonStyle.secondary, emoji="▶️")
+    async def next_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.show_page(interaction, self.page + 1)
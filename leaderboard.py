@@ -0,0 +1,192 @@
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32
+# 勝率ランキングに載るための最低試合数
+MIN_GAMES_FOR_WIN_RATE = 10
+
+class RankIndex:
+    """スコア順に並べたメンバーの索引
+
+    (ソートキー, メンバー) のタプルをソート済みリストで保持する。
+    順位の検索は二分探索なので O(log n)、上位N件は先頭からN件を切り出すだけで済む。
+    """
+    def __init__(self):
+        self._items: List[Tuple[tuple, str]] = []
+        self._keys: Dict[str, tuple] = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def update(self, member: str, sort_key: tuple):
+        self.discard(member)
+        self._keys[member] = sort_key
+        insort(self._items, (sort_key, member))
+
+    def build(self, items: Dict[str, tuple]):
+        """{メンバー: ソートキー} から索引を一度に作り直す"""
+        self._keys = dict(items)
+        self._items = sorted((key, member) for member, key in items.items())
+
+    def discard(self, member: str):
+        old_key = self._keys.pop(member, None)
+        if old_key is not None:
+            del self._items[bisect_left(self._items, (old_key, member))]
+
+    def top(self, n: int) -> List[str]:
+        return [member for _, member in self._items[:n]]
+
+    def rank(self, member: str) -> Optional[int]:
+        """1始まりの順位（索引にいなければ None）"""
+        key = self._keys.get(member)
+        if key is None:
+            return None
+        return bisect_left(self._items, (key, member)) + 1
+
+class Leaderboard:
+    """プレイヤーまたはデッキごとの戦績とレートを保持し、種類ごとの順位を管理する"""
+    KINDS = ('winrate', 'games', 'rating')
+
+    def __init__(self, indexed: bool = True):
+        self.entries: Dict[str, Dict] = {}
+        self.indexes = {kind: RankIndex() for kind in self.KINDS}
+        # False の間は戦績だけを更新し、索引は build_indexes() でまとめて作る
+        self.indexed = indexed
+
+    def get(self, member: str) -> Dict:
+        entry = self.entries.get(member)
+        if entry is None:
+            entry = {'name': member, 'wins': 0, 'losses': 0, 'rating': INITIAL_RATING}
+            self.entries[member] = entry
+        return entry
+
+    def rating(self, member: str) -> float:
+        entry = self.entries.get(member)
+        return entry['rating'] if entry else INITIAL_RATING
+
+    def add_result(self, member: str, won: bool):
+        entry = self.get(member)
+        if won:
+            entry['wins'] += 1
+        else:
+            entry['losses'] += 1
+        self._reindex(member)
+
+    def set_rating(self, member: str, rating: float):
+        self.get(member)['rating'] = rating
+        self._reindex(member)
+
+    def remove(self, member: str):
+        self.entries.pop(member, None)
+        for index in self.indexes.values():
+            index.discard(member)
+
+    def _sort_keys(self, member: str) -> Dict[str, tuple]:
+        """各ランキングでのソートキー（載らないランキングは含めない）"""
+        entry = self.entries[member]
+        total = entry['wins'] + entry['losses']
+        keys = {}
+        if total == 0:
+            return keys
+        # 同じスコアの場合は試合数の多い方を上位にする
+        if total >= MIN_GAMES_FOR_WIN_RATE:
+            keys['winrate'] = (-entry['wins'] / total, -total)
+        keys['games'] = (-total,)
+        keys['rating'] = (-entry['rating'], -total)
+        return keys
+
+    def _reindex(self, member: str):
+        if not self.indexed:
+            return
+        keys = self._sort_keys(member)
+        for kind, index in self.indexes.items():
+            if kind in keys:
+                index.update(member, keys[kind])
+            else:
+                index.discard(member)
+
+    def build_indexes(self):
+        items = {kind: {} for kind in self.KINDS}
+        for member in self.entries:
+            for kind, key in self._sort_keys(member).items():
+                items[kind][member] = key
+        for kind, index in self.indexes.items():
+            index.build(items[kind])
+        self.indexed = True
+
+    def top(self, kind: str, n: int) -> List[Dict]:
+        return [self.summary(member) for member in self.indexes[kind].top(n)]
+
+    def rank(self, kind: str, member: str) -> Optional[int]:
+        return self.indexes[kind].rank(member)
+
+    def size(self, kind: str) -> int:
+        return len(self.indexes[kind])
+
+    def summary(self, member: str) -> Dict:
+        entry = self.entries[member]
+        total = entry['wins'] + entry['losses']
+        return {
+            'id': member,
+            'name': entry['name'],
+            'wins': entry['wins'],
+            'losses': entry['losses'],
+            'total': total,
+            'win_rate': (entry['wins'] / total * 100) if total > 0 else 0,
+            'rating': entry['rating']
+        }
+
+def expected_score(rating: float, opponent_rating: float) -> float:
+    """Eloの期待勝率"""
+    return 1 / (1 + 10 ** ((opponent_rating - rating) / 400))
+
+class RatingManager:
+    """対戦記録からプレイヤー・デッキのランキングを差分更新する
+
+    プレイヤーの対戦相手は記録されていないので、プレイヤーのレートは
+    相手デッキのレートを対戦相手の強さとみなして更新する。
+    デッキのレートは自分デッキと相手デッキの対戦として両方を更新する。
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.players = Leaderboard()
+        self.decks = Leaderboard()
+
+    def rebuild(self, rows):
+        """(プレイヤー名, プレイヤーID, 勝敗, 自分デッキ, 相手デッキ) を古い順に流し込んで再構築
+
+        記録ごとに索引を更新すると遅いので、戦績とレートを集計し終えてから索引を一度だけ作る。
+        """
+        self.players = Leaderboard(indexed=False)
+        self.decks = Leaderboard(indexed=False)
+        for player_name, player_id, result, my_deck, opponent_deck in rows:
+            self.apply_record(player_name, player_id, result, my_deck, opponent_deck)
+        self.players.build_indexes()
+        self.decks.build_indexes()
+
+    def apply_record(self, player_name: str, player_id, result: str, my_deck: str, opponent_deck: str):
+        if result not in ('勝ち', '負け'):
+            return
+        won = result == '勝ち'
+        score = 1.0 if won else 0.0
+        player_id = str(player_id)
+
+        my_deck_rating = self.decks.rating(my_deck)
+        opponent_deck_rating = self.decks.rating(opponent_deck)
+        player_rating = self.players.rating(player_id)
+
+        self.players.get(player_id)['name'] = player_name
+        self.players.add_result(player_id, won)
+        self.players.set_rating(
+            player_id, player_rating + K_FACTOR * (score - expected_score(player_rating, opponent_deck_rating)))
+
+        self.decks.add_result(my_deck, won)
+        # ミラーマッチは1試合として数え、デッキのレートは動かさない
+        if my_deck != opponent_deck:
+            self.decks.add_result(opponent_deck, not won)
+            delta = K_FACTOR * (score - expected_score(my_deck_rating, opponent_deck_rating))
+            self.decks.set_rating(my_deck, my_deck_rating + delta)
+            self.decks.set_rating(opponent_deck, opponent_deck_rating - delta)
@@ -0,0 +1,452 @@
+"""ボット全体のオフライン負荷試験
+
+    python loadtest.py --users 200
+    python loadtest.py --users 200 --ramp 5 --save-stream stream.jsonl
+    python loadtest.py --replay stream.jsonl
+
+main.py の bot に、ゲートウェイから届くのと同じ形式のメッセージとボタン操作を流し込む。
+Discordへの送信は偽のHTTP層が、OpenAIへのリクエストはローカルのスタブが受けるので、
+ネットワークにもトークンにも依存しない。コマンド・ボタン操作ごとのレイテンシ、
+スループット、イベントループが止まっていた時間を計測する。
+
+ストリームは1行1イベントのJSONで、{"at": 開始からの秒数, "user": ユーザー番号, "content": メッセージ}。
+"!record" は勝敗・デッキ・先攻後攻のボタン操作まで続けて行う。
+"""
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from discord.user import ClientUser
+from discord.webhook.async_ import AsyncWebhookAdapter, async_context
+
+from benchmark import generate_records, percentile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+GUILD_ID = 100000000000000001
+APPLICATION_ID = 100000000000000002
+BOT_USER = {'id': '100000000000000003', 'username': 'Ralmia', 'discriminator': '0', 'avatar': None, 'bot': True}
+# ボタン操作を受けてから応答するまでの上限（Discordの制限と同じ3秒ではなく、詰まりを観測できるよう長めにする）
+RESPONSE_TIMEOUT = 60
+
+# 合成ストリームでのコマンドの比率
+SCENARIO = [
+    ("!record", 0.5),
+    ("!stats", 0.3),
+    ("!ララミア 今日のおすすめデッキは？", 0.2),
+]
+
+# ===== OpenAI スタブ =====
+
+class OpenAIStubHandler(BaseHTTPRequestHandler):
+    latency = 0.5
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.latency)
+        body = json.dumps({
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "gpt-3.5-turbo",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "スタブだよ！"},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_openai_stub(latency):
+    OpenAIStubHandler.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), OpenAIStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+# ===== 偽のDiscord =====
+
+class FakeDiscord:
+    """ボットが送るHTTPリクエストを受け、送信されたメッセージを待っている側に渡す"""
+    def __init__(self):
+        self.ids = itertools.count(200000000000000000)
+        self.waiters = {}
+        self.interaction_channels = {}
+        self.interaction_messages = {}
+        self.requests = defaultdict(int)
+
+    def snowflake(self):
+        return next(self.ids)
+
+    def expect(self, key):
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[key] = future
+        return future
+
+    def resolve(self, key, message):
+        future = self.waiters.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(message)
+
+    def make_message(self, channel_id, data, author=BOT_USER, message_id=None):
+        return {
+            'id': str(message_id or self.snowflake()),
+            'channel_id': str(channel_id),
+            'guild_id': str(GUILD_ID),
+            'author': author,
+            'content': data.get('content') or '',
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'edited_timestamp': None,
+            'tts': False,
+            'mention_everyone': False,
+            'mentions': [],
+            'mention_roles': [],
+            'attachments': [],
+            'embeds': data.get('embeds') or [],
+            'components': data.get('components') or [],
+            'pinned': False,
+            'type': 0,
+            'flags': data.get('flags') or 0
+        }
+
+    async def request(self, route, *, files=None, form=None, **kwargs):
+        """discord.http.HTTPClient.request の代わり"""
+        self.requests[f"{route.method} {route.path}"] += 1
+        if route.method == 'POST' and route.path == '/channels/{channel_id}/messages':
+            payload = kwargs.get('json')
+            if payload is None and form:
+                payload = json.loads(form[0]['value'])
+            message = self.make_message(route.channel_id, payload or {})
+            self.resolve(('channel', int(route.channel_id)), message)
+            return message
+        return None
+
+    def interaction_request(self, route, payload):
+        """インタラクションの応答・フォローアップ"""
+        self.requests[f"{route.method} {route.path}"] += 1
+        interaction_id = int(route.webhook_id)
+        channel_id = self.interaction_channels.get(interaction_id)
+
+        if route.path.endswith('/callback'):
+            response_type = payload['type']
+            data = payload.get('data') or {}
+            result = {'interaction': {'id': str(interaction_id), 'type': 3}}
+            message = None
+            if response_type in (4, 7):
+                # 7（元のメッセージの編集）は同じIDのまま内容を差し替える
+                message_id = self.interaction_messages.get(interaction_id) if response_type == 7 else None
+                message = self.make_message(channel_id, data, message_id=message_id)
+                result['interaction']['response_message_id'] = message['id']
+                result['resource'] = {'type': response_type, 'message': message}
+            self.resolve(('interaction', interaction_id), message)
+            return result
+
+        if route.method == 'POST':
+            # フォローアップ
+            return self.make_message(channel_id, payload or {})
+        return None
+
+class FakeWebhookAdapter(AsyncWebhookAdapter):
+    """インタラクションの応答はHTTPClientではなくWebhookのアダプタを通るので、こちらも差し替える"""
+    def __init__(self, fake):
+        super().__init__()
+        self.fake = fake
+
+    async def request(self, route, session=None, *, payload=None, multipart=None, **kwargs):
+        if payload is None and multipart:
+            payload = json.loads(multipart[0]['value'])
+        return self.fake.interaction_request(route, payload)
+
+# ===== 仮想ユーザー =====
+
+class VirtualUser:
+    def __init__(self, index):
+        self.index = index
+        self.user_id = 300000000000000000 + index
+        self.channel_id = 400000000000000000 + index
+        self.user = {'id': str(self.user_id), 'username': f'loadtest{index}', 'discriminator': '0',
+                     'global_name': f'負荷試験{index}', 'avatar': None, 'bot': False}
+        self.member = {'roles': [], 'joined_at': '2025-01-01T00:00:00+00:00', 'deaf': False, 'mute': False,
+                       'flags': 0, 'permissions': '0'}
+        self.lock = asyncio.Lock()
+
+def build_guild(users):
+    return {
+        'id': str(GUILD_ID),
+        'name': 'loadtest',
+        'owner_id': BOT_USER['id'],
+        'icon': None,
+        'features': [],
+        'emojis': [],
+        'stickers': [],
+        'roles': [{'id': str(GUILD_ID), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+                   'hoist': False, 'managed': False, 'mentionable': False, 'flags': 0}],
+        'channels': [{'id': str(user.channel_id), 'type': 0, 'name': f'loadtest-{user.index}', 'position': user.index,
+                      'permission_overwrites': [], 'nsfw': False, 'parent_id': None} for user in users],
+        'members': [dict(user.member, user=user.user) for user in users],
+        'member_count': len(users),
+        'large': False,
+        'verification_level': 0,
+        'default_message_notifications': 0,
+        'explicit_content_filter': 0,
+        'mfa_level': 0,
+        'premium_tier': 0,
+        'preferred_locale': 'ja',
+        'nsfw_level': 0
+    }
+
+def find_component(message, component_type, label=None):
+    for row in message['components']:
+        for component in row.get('components', []):
+            if component['type'] == component_type and (label is None or component.get('label') == label):
+                return component
+    raise LookupError(f"コンポーネントが見つからない: type={component_type} label={label}")
+
+# ===== 負荷試験本体 =====
+
+class ErrorCounter(logging.Handler):
+    def __init__(self, errors):
+        super().__init__(level=logging.ERROR)
+        self.errors = errors
+
+    def emit(self, record):
+        error = record.exc_info[1] if record.exc_info else None
+        self.errors[f"{record.name}: {type(error).__name__ if error else record.getMessage()}"] += 1
+
+class LoadTest:
+    def __init__(self, bot, users, rng):
+        self.bot = bot
+        self.state = bot._connection
+        self.users = users
+        self.rng = rng
+        self.fake = FakeDiscord()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.loop_lags = []
+
+    async def setup(self):
+        await self.bot._async_setup_hook()
+        self.bot.http.request = self.fake.request
+        # 以降に作られるタスクはこのコンテキストを引き継ぐ
+        async_context.set(FakeWebhookAdapter(self.fake))
+
+        self.state.application_id = APPLICATION_ID
+        self.state.user = ClientUser(state=self.state, data=BOT_USER)
+        self.state._add_guild_from_data(build_guild(self.users))
+
+        async def on_command_error(ctx, error):
+            self.errors[f"{ctx.command}: {type(error).__name__}"] += 1
+        self.bot.add_listener(on_command_error, 'on_command_error')
+        # ビューのコールバックで起きた例外は discord.py がログに出すだけなので、ログから数える
+        logging.getLogger("discord").addHandler(ErrorCounter(self.errors))
+
+    async def send_message(self, user, content):
+        """MESSAGE_CREATE を流し、ボットがそのチャンネルに送る最初のメッセージを待つ"""
+        future = self.fake.expect(('channel', user.channel_id))
+        data = self.fake.make_message(user.channel_id, {'content': content}, author=user.user)
+        data['member'] = user.member
+        started = time.perf_counter()
+        self.state.parsers['MESSAGE_CREATE'](data)
+        message = await asyncio.wait_for(future, RESPONSE_TIMEOUT)
+        self.latencies[content.split()[0]].append(time.perf_counter() - started)
+        return message
+
+    async def interact(self, user, label, message, custom_id, component_type, values=None):
+        """INTERACTION_CREATE（コンポーネント操作）を流し、ボットの応答を待つ"""
+        interaction_id = self.fake.snowflake()
+        self.fake.interaction_channels[interaction_id] = user.channel_id
+        self.fake.interaction_messages[interaction_id] = int(message['id'])
+        future = self.fake.expect(('interaction', interaction_id))
+        data = {
+            'id': str(interaction_id),
+            'application_id': str(APPLICATION_ID),
+            'type': 3,
+            'token': f'token-{interaction_id}',
+            'version': 1,
+            'guild_id': str(GUILD_ID),
+            'channel_id': str(user.channel_id),
+            'channel': {'id': str(user.channel_id), 'type': 0, 'guild_id': str(GUILD_ID), 'name': f'loadtest-{user.index}'},
+            'member': dict(user.member, user=user.user),
+            'message': message,
+            'data': {'custom_id': custom_id, 'component_type': component_type, 'values': values or []},
+            'app_permissions': '0',
+            'locale': 'ja',
+            'guild_locale': 'ja',
+            'entitlements': [],
+            'authorizing_integration_owners': {},
+            'attachment_size_limit': 8388608
+        }
+        started = time.perf_counter()
+        self.state.parsers['INTERACTION_CREATE'](data)
+        response = await asyncio.wait_for(future, RESPONSE_TIMEOUT)
+        self.latencies[label].append(time.perf_counter() - started)
+        return response
+
+    async def click(self, user, label, message, button_label):
+        button = find_component(message, 2, button_label)
+        return await self.interact(user, label, message, button['custom_id'], 2)
+
+    async def select(self, user, label, message):
+        select = find_component(message, 3)
+        value = self.rng.choice(select['options'])['value']
+        return await self.interact(user, label, message, select['custom_id'], 3, [value])
+
+    async def record_flow(self, user):
+        message = await self.send_message(user, "!record")
+        message = await self.click(user, "record:勝敗", message, self.rng.choice(["勝ち", "負け"]))
+        message = await self.select(user, "record:自分デッキ", message)
+        message = await self.select(user, "record:相手デッキ", message)
+        await self.click(user, "record:先攻後攻", message, self.rng.choice(["先攻", "後攻"]))
+
+    async def run_event(self, started, event):
+        await asyncio.sleep(max(0, started + event['at'] - time.perf_counter()))
+        user = self.users[event['user'] % len(self.users)]
+        # 一人のユーザーは前の操作が終わってから次を送る
+        async with user.lock:
+            try:
+                if event['content'].split()[0] == "!record":
+                    await self.record_flow(user)
+                else:
+                    await self.send_message(user, event['content'])
+            except asyncio.TimeoutError:
+                self.errors[f"{event['content'].split()[0]}: タイムアウト"] += 1
+            except Exception as e:
+                self.errors[f"{event['content'].split()[0]}: {type(e).__name__}"] += 1
+
+    async def monitor_loop(self, interval):
+        """sleep が予定よりどれだけ遅れて戻るかで、イベントループの停止時間を測る"""
+        loop = asyncio.get_running_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(interval)
+            self.loop_lags.append(max(0.0, loop.time() - before - interval))
+
+    async def run(self, events, monitor_interval):
+        await self.setup()
+        monitor = asyncio.create_task(self.monitor_loop(monitor_interval))
+        started = time.perf_counter()
+        await asyncio.gather(*(self.run_event(started, event) for event in events))
+        elapsed = time.perf_counter() - started
+        monitor.cancel()
+        # 応答後に残っている処理（ビューのタイムアウト待ちなど）は計測に含めない
+        return elapsed
+
+def synthetic_stream(users, events_per_user, ramp, rng):
+    commands, weights = zip(*SCENARIO)
+    events = []
+    for user in range(users):
+        for _ in range(events_per_user):
+            events.append({'at': round(rng.uniform(0, ramp), 3), 'user': user, 'content': rng.choices(commands, weights)[0]})
+    events.sort(key=lambda event: event['at'])
+    return events
+
+def load_stream(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def format_ms(seconds):
+    return f"{seconds * 1000:8.1f}"
+
+def display_width(text):
+    """全角文字を2桁として数えた表示幅"""
+    return sum(2 if unicodedata.east_asian_width(char) in "WF" else 1 for char in text)
+
+def ljust_width(text, width):
+    """全角文字を2桁として左詰めする"""
+    return text + " " * max(0, width - display_width(text))
+
+def report(test, elapsed, monitor_interval):
+    operations = sum(len(samples) for samples in test.latencies.values())
+    print(f"経過時間: {elapsed:.2f}秒  完了した操作: {operations}  スループット: {operations / elapsed:.1f} ops/s")
+    print()
+    label_width = max(display_width(label) for label in ['操作', *test.latencies]) + 2
+    print(f"{ljust_width('操作', label_width)}{'件数':>4}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'max(ms)':>10}")
+    for label, samples in sorted(test.latencies.items()):
+        print(f"{ljust_width(label, label_width)}{len(samples):>6}{format_ms(percentile(samples, 50)):>10}{format_ms(percentile(samples, 95)):>10}"
+              f"{format_ms(percentile(samples, 99)):>10}{format_ms(max(samples)):>10}")
+    print()
+
+    lags = test.loop_lags or [0.0]
+    stalled = [lag for lag in lags if lag >= monitor_interval]
+    print(f"イベントループ停止: 合計 {sum(stalled):.2f}秒（{len(stalled)}回）  最大 {max(lags) * 1000:.1f}ms  "
+          f"p99 {percentile(lags, 99) * 1000:.1f}ms")
+    print(f"Discordへのリクエスト: {sum(test.fake.requests.values())}件")
+
+    if test.errors:
+        print()
+        print("エラー:")
+        for error, count in sorted(test.errors.items()):
+            print(f"  {error}: {count}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="仮想ユーザー数")
+    parser.add_argument("--events-per-user", type=int, default=1, help="ユーザーあたりの操作数（合成ストリーム）")
+    parser.add_argument("--ramp", type=float, default=0.0, help="操作を送り始めるまでの時間の幅（秒、0なら全員同時）")
+    parser.add_argument("--replay", help="記録したストリーム（JSONL）を再生する")
+    parser.add_argument("--save-stream", help="合成したストリームをJSONLで保存する")
+    parser.add_argument("--records", type=int, default=10000, help="事前に生成する対戦記録の件数")
+    parser.add_argument("--openai-latency", type=float, default=0.5, help="OpenAIスタブの応答時間（秒）")
+    parser.add_argument("--monitor-interval", type=float, default=0.01, help="イベントループ監視の間隔（秒）")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    if args.replay:
+        events = load_stream(args.replay)
+    else:
+        events = synthetic_stream(args.users, args.events_per_user, args.ramp, rng)
+        if args.save_stream:
+            with open(args.save_stream, "w", encoding="utf-8") as f:
+                for event in events:
+                    f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    user_count = max(args.users, max((event['user'] for event in events), default=0) + 1)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        generate_records(os.path.join(tmp_dir, "game_records.db"), args.records, seed=args.seed)
+        server, base_url = start_openai_stub(args.openai_latency)
+        os.environ["OPENAI_API_KEY"] = "loadtest"
+        os.environ["OPENAI_BASE_URL"] = base_url
+
+        # main.py はカレントディレクトリにデータベースを作るので、一時ディレクトリで読み込む
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)
+        sys.path.insert(0, REPO_DIR)
+        try:
+            bot = importlib.import_module("main").bot
+
+            async def run():
+                users = [VirtualUser(i) for i in range(user_count)]
+                test = LoadTest(bot, users, rng)
+                elapsed = await test.run(events, args.monitor_interval)
+                return test, elapsed
+
+            test, elapsed = asyncio.run(run())
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+
+    report(test, elapsed, args.monitor_interval)
+
+if __name__ == "__main__":
+    main()
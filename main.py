@@ -1,7 +1,9 @@
+import asyncio
+import json
 import random
-import sqlite3
-from discord.ext import commands
+from discord.ext import commands, tasks
 import time
+import typing
 import urllib.parse
 import discord
 import os
@@ -9,8 +11,11 @@ from threading import Thread
 from flask import Flask
 from collections import defaultdict
 from database_manager import DatabaseManager
-from game_ui import GameRecordView, DeckManageView, ResetRecordsView, RateDeckSelectView
-from chat_history_manager import init_db, save_message, load_history, delete_history
+from leaderboard import MIN_GAMES_FOR_WIN_RATE
+from search_utils import MIN_MATCH_LENGTH, build_match_query
+from backup_manager import BACKUP_INTERVAL_HOURS, backup_database, list_snapshots, find_snapshot
+from game_ui import GameRecordView, DeckManageView, ResetRecordsView, RateDeckSelectView, RecentRecordsView, SearchResultsView, RestoreView, build_recent_embed, build_memo_search_embed, build_chat_search_embed
+from chat_history_manager import DB_NAME as CHAT_DB_NAME, init_db, save_message, load_history, delete_history, search_history
 from openai import OpenAI
 
 client = OpenAI(
@@ -26,6 +31,9 @@ TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 bot = commands.Bot(command_prefix="!", intents=discord.Intents.all())
 db_manager = DatabaseManager()
 
+# 定期バックアップの対象
+BACKUP_TARGETS = [db_manager.db_path, CHAT_DB_NAME]
+
 # ===== Flaskサーバーを用意してポートを開く（Renderの要件） =====
 app = Flask(__name__)
 
@@ -37,12 +45,27 @@ def run_flask():
     port = int(os.environ.get("PORT", 8080))  # Renderが自動で設定する
     app.run(host="0.0.0.0", port=port)
 
-Thread(target=run_flask).start()
-
 @bot.event
 async def on_ready():
     print(f"ログイン成功: {bot.user}")
     print("SQLiteデータベース初期化完了！")
+    if not scheduled_backup.is_running():
+        scheduled_backup.start()
+
+async def run_backups():
+    """すべてのデータベースをバックアップ（イベントループを止めないよう別スレッドで実行）"""
+    results = []
+    for db_path in BACKUP_TARGETS:
+        results.append(await asyncio.to_thread(backup_database, db_path))
+    return results
+
+@tasks.loop(hours=BACKUP_INTERVAL_HOURS)
+async def scheduled_backup():
+    try:
+        for result in await run_backups():
+            print(f"バックアップ完了: {result['path']}（{result['duration']:.2f}秒）")
+    except Exception as e:
+        print(f"バックアップエラー: {e}")
 
 @bot.command()
 async def record(ctx):
@@ -58,10 +81,14 @@ async def decks(ctx):
         await ctx.send("デッキリストが見つかりません。")
         return
     
-    embed = discord.Embed(title="🃏 デッキリスト", color=0x0099ff)
+    def build_decks_embed():
+        embed = discord.Embed(title="🃏 デッキリスト", color=0x0099ff)
+        
+        deck_text = "\n".join([f" {deck_name}" for deck_name in deck_list])
+        embed.add_field(name="登録済みデッキ", value=deck_text, inline=False)
+        return embed
     
-    deck_text = "\n".join([f" {deck_name}" for deck_name in deck_list])
-    embed.add_field(name="登録済みデッキ", value=deck_text, inline=False)
+    embed = db_manager.cache.get_or_build(("decks",), ("decks",), build_decks_embed)
     
     await ctx.send(embed=embed, view=DeckManageView(db_manager))
 
@@ -88,18 +115,23 @@ async def stats(ctx, user_mention=None):
     else:
         user_id = ctx.author.id
     
-    stats = db_manager.get_user_stats(user_id)
-    
-    embed = discord.Embed(title="📊 対戦統計", color=0x0099ff)
-    embed.add_field(name="勝利数", value=f"️⭕️ {stats['wins']}", inline=True)
-    embed.add_field(name="敗北数", value=f"❌ {stats['losses']}", inline=True)
-    embed.add_field(name="勝率", value=f"📈 {stats['win_rate']:.1f}%", inline=True)
-    embed.add_field(name="総試合数", value=f"🎮 {stats['total']}", inline=False)
-    
     if user_mention and ctx.message.mentions:
-        embed.set_footer(text=f"{ctx.message.mentions[0].display_name}の統計")
+        footer = f"{ctx.message.mentions[0].display_name}の統計"
     else:
-        embed.set_footer(text=f"{ctx.author.display_name}の統計")
+        footer = f"{ctx.author.display_name}の統計"
+    
+    def build_stats_embed():
+        stats = db_manager.get_user_stats(user_id)
+        
+        embed = discord.Embed(title="📊 対戦統計", color=0x0099ff)
+        embed.add_field(name="勝利数", value=f"️⭕️ {stats['wins']}", inline=True)
+        embed.add_field(name="敗北数", value=f"❌ {stats['losses']}", inline=True)
+        embed.add_field(name="勝率", value=f"📈 {stats['win_rate']:.1f}%", inline=True)
+        embed.add_field(name="総試合数", value=f"🎮 {stats['total']}", inline=False)
+        embed.set_footer(text=footer)
+        return embed
+    
+    embed = db_manager.cache.get_or_build(("stats", user_id, footer), ("records",), build_stats_embed)
     
     await ctx.send(embed=embed)  
 
@@ -174,43 +206,88 @@ async def ララミア(ctx, *, prompt):
         await ctx.send(f"⚠️ エラーが発生しました: {e}")
 
 @bot.command()
-async def recent(ctx, limit=10):
-    """最近の対戦記録を表示"""
-    records = db_manager.get_recent_records(limit)
+async def recent(ctx, limit: typing.Optional[int] = 10, member: typing.Optional[discord.Member] = None, *, deck=None):
+    """最近の対戦記録を表示（!recent [件数] [@ユーザー] [デッキ名]）"""
+    player_id = member.id if member else None
+    
+    title = "📝 最近の対戦記録"
+    if member:
+        title += f"（{member.display_name}）"
+    if deck:
+        title += f"［{deck}］"
+    
+    def build_recent_page():
+        records, has_newer, has_older = db_manager.get_recent_records_page(limit, player_id=player_id, deck=deck)
+        embed = build_recent_embed(records, title) if records else None
+        return records, has_newer, has_older, embed
+    
+    records, has_newer, has_older, embed = db_manager.cache.get_or_build(
+        ("recent", limit, player_id, deck, title), ("records",), build_recent_page)
     
     if not records:
         await ctx.send("対戦記録が見つからないよ")
         return
     
-    embed = discord.Embed(title="📝 最近の対戦記録", color=0x0099ff)
-    
-    for i, record in enumerate(records, 1):
-        result_emoji = "️⭕️" if record['勝敗'] == "勝ち" else "❌"
-        turn_emoji = "2️⃣" if record['先攻後攻'] == "先攻" else "1️⃣"
-        
-        field_name = f"{i}. {record['プレイヤー']} {result_emoji}"
-        field_value = f"{record['自分デッキ']} vs {record['相手デッキ']} {turn_emoji}\n{record['日時']}"
-        
-        embed.add_field(name=field_name, value=field_value, inline=False)
-    
-    await ctx.send(embed=embed)
+    view = RecentRecordsView(db_manager, records, has_newer, has_older, limit,
+                             player_id=player_id, deck=deck, title=title)
+    await ctx.send(embed=embed, view=view)
+
+SEARCH_PAGE_SIZE = 5
 
 @bot.command()
-async def deckpie(ctx):
-    conn = sqlite3.connect("game_records.db")
-    cursor = conn.cursor()
+async def search(ctx, *, query):
+    """対戦メモを全文検索（!search キーワード）"""
+    if build_match_query(query) is None:
+        await ctx.send(f"🔍 {MIN_MATCH_LENGTH}文字以上のキーワードを1つ以上入れてね！")
+        return
+
+    records, has_next = db_manager.search_memos(query, SEARCH_PAGE_SIZE)
+
+    if not records:
+        await ctx.send(f"「{query}」を含むメモは見つからなかったよ")
+        return
+
+    view = SearchResultsView(db_manager.search_memos, build_memo_search_embed, query, SEARCH_PAGE_SIZE, has_next)
+    await ctx.send(embed=build_memo_search_embed(query, records), view=view)
+
+@bot.command()
+async def searchchat(ctx, *, query):
+    """自分とララミアの会話履歴を全文検索（!searchchat キーワード）"""
+    if build_match_query(query) is None:
+        await ctx.send(f"🔍 {MIN_MATCH_LENGTH}文字以上のキーワードを1つ以上入れてね！")
+        return
+
+    player_id = ctx.author.id
+
+    def search_own(query, limit, offset):
+        return search_history(player_id, query, limit, offset)
+
+    results, has_next = search_own(query, SEARCH_PAGE_SIZE, 0)
+
+    if not results:
+        await ctx.send(f"「{query}」を含む会話は見つからなかったよ…")
+        return
+
+    view = SearchResultsView(search_own, build_chat_search_embed, query, SEARCH_PAGE_SIZE, has_next)
+    await ctx.send(embed=build_chat_search_embed(query, results), view=view)
 
-    cursor.execute('SELECT "opponent_deck" FROM game_records')
-    rows = cursor.fetchall()
-    conn.close()
+@bot.command()
+async def deckpie(ctx):
+    embed = db_manager.cache.get_or_build(("deckpie",), ("records",), build_deckpie_embed)
 
-    if not rows:
+    if embed is None:
         await ctx.send("データが見つからないよ")
         return
 
-    # カウント
-    from collections import Counter
-    deck_counts = Counter(deck for (deck,) in rows)
+    # Discordに送信
+    await ctx.send(embed=embed)
+
+def build_deckpie_embed():
+    """相手デッキの分布の円グラフEmbedを作成（記録がなければ None）"""
+    deck_counts = db_manager.get_opponent_deck_counts()
+    if not deck_counts:
+        return None
+
     labels = list(deck_counts.keys())
     values = list(deck_counts.values())
 
@@ -225,35 +302,158 @@ async def deckpie(ctx):
         }
     }
 
-    import json
     encoded_config = urllib.parse.quote(json.dumps(chart_config))
     chart_url = f"https://quickchart.io/chart?c={encoded_config}"
 
-    # Discordに送信
     embed = discord.Embed(title="📊 相手デッキの分布（円グラフ）")
     embed.set_image(url=chart_url)
-    await ctx.send(embed=embed)
+    return embed
 
 @bot.command()
 async def reset_own(ctx):
     player_id = str(ctx.author.id)
 
-    # SQLite接続
-    conn = sqlite3.connect("game_records.db")
-    cursor = conn.cursor()
-
     # 自分の戦績のみ削除
-    cursor.execute('DELETE FROM game_records WHERE player_id = ?', (player_id,))
-    deleted_rows = cursor.rowcount  # 削除件数
-
-    conn.commit()
-    conn.close()
+    deleted_rows = db_manager.reset_own_records(player_id)
+    if deleted_rows > 0:
+        await db_manager.reload_ratings()
 
     if deleted_rows > 0:
         await ctx.send(f"{ctx.author.mention} さんの対戦記録 {deleted_rows} 件を削除しました ✅")
     else:
         await ctx.send(f"{ctx.author.mention} さんの対戦記録は見つからなかったよ ⚠️")
 
+# ランキングの種類（コマンド引数 → 内部名, 表示名）
+RANKING_KINDS = {
+    "winrate": ("winrate", "勝率"),
+    "勝率": ("winrate", "勝率"),
+    "games": ("games", "試合数"),
+    "試合数": ("games", "試合数"),
+    "rating": ("rating", "レート"),
+    "レート": ("rating", "レート"),
+}
+
+def format_ranking_line(rank, entry, kind):
+    if kind == "winrate":
+        value = f"勝率 {entry['win_rate']:.1f}%（{entry['total']}戦 {entry['wins']}勝）"
+    elif kind == "games":
+        value = f"{entry['total']}戦（{entry['wins']}勝 {entry['losses']}敗）"
+    else:
+        value = f"レート {entry['rating']:.0f}（{entry['total']}戦）"
+    return f"**{rank}.** {entry['name']} — {value}"
+
+async def send_ranking(ctx, target, kind_name, limit):
+    if kind_name not in RANKING_KINDS:
+        await ctx.send("❌ ランキングの種類は 勝率 / 試合数 / レート から選んでね！")
+        return
+    kind, label = RANKING_KINDS[kind_name]
+
+    entries = db_manager.get_leaderboard(target, kind, limit)
+    if not entries:
+        await ctx.send("ランキングに載っている記録がまだないよ")
+        return
+
+    lines = [format_ranking_line(i, entry, kind) for i, entry in enumerate(entries, 1)]
+    title = "🏅 プレイヤー" if target == "player" else "🏅 デッキ"
+    embed = discord.Embed(title=f"{title}ランキング（{label}）", description="\n".join(lines), color=0xffcc00)
+    if kind == "winrate":
+        embed.set_footer(text=f"{MIN_GAMES_FOR_WIN_RATE}戦以上のみ対象")
+    await ctx.send(embed=embed)
+
+@bot.command()
+async def ranking(ctx, kind="rating", limit=10):
+    """プレイヤーランキングを表示（!ranking [勝率|試合数|レート] [件数]）"""
+    await send_ranking(ctx, "player", kind, limit)
+
+@bot.command()
+async def deckranking(ctx, kind="rating", limit=10):
+    """デッキランキングを表示（!deckranking [勝率|試合数|レート] [件数]）"""
+    await send_ranking(ctx, "deck", kind, limit)
+
+@bot.command()
+async def myrank(ctx):
+    """自分の順位を表示"""
+    summary = db_manager.get_rating_summary("player", ctx.author.id)
+    if not summary:
+        await ctx.send("対戦記録がまだないよ！ `!record` で記録してね")
+        return
+
+    embed = discord.Embed(title=f"🏅 {ctx.author.display_name} の順位", color=0xffcc00)
+    for kind, label in [("rating", "レート"), ("winrate", "勝率"), ("games", "試合数")]:
+        rank, size = db_manager.get_rank("player", kind, ctx.author.id)
+        if rank is None:
+            value = f"{MIN_GAMES_FOR_WIN_RATE}戦以上で対象になるよ"
+        else:
+            value = f"{rank}位 / {size}人"
+        embed.add_field(name=label, value=value, inline=True)
+    embed.set_footer(text=f"レート {summary['rating']:.0f} ・ {summary['total']}戦 {summary['wins']}勝（勝率 {summary['win_rate']:.1f}%）")
+    await ctx.send(embed=embed)
+
+@bot.command()
+async def backup(ctx):
+    """データベースを今すぐバックアップ（管理者のみ）"""
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ この機能は管理者のみが使用できます。")
+        return
+
+    try:
+        results = await run_backups()
+    except Exception as e:
+        await ctx.send(f"❌ バックアップに失敗しました: {e}")
+        return
+
+    embed = discord.Embed(title="💾 バックアップ完了", color=0x00ff00)
+    for result in results:
+        embed.add_field(name=os.path.basename(result['path']),
+                        value=f"{result['size'] / 1024:.1f} KB・{result['duration']:.2f}秒", inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command()
+async def backups(ctx):
+    """スナップショットの一覧を表示（管理者のみ）"""
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ この機能は管理者のみが使用できます。")
+        return
+
+    embed = discord.Embed(title="💾 スナップショット一覧", color=0x0099ff)
+    for db_path in BACKUP_TARGETS:
+        names = [os.path.basename(path) for path in list_snapshots(db_path)]
+        embed.add_field(name=os.path.basename(db_path), value="\n".join(names) or "なし", inline=False)
+    await ctx.send(embed=embed)
+
+@bot.command()
+async def restore(ctx, name):
+    """スナップショットからデータベースを復元（管理者のみ、!restore ファイル名）"""
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ この機能は管理者のみが使用できます。")
+        return
+
+    for db_path in BACKUP_TARGETS:
+        snapshot_path = find_snapshot(db_path, name)
+        if snapshot_path:
+            break
+    else:
+        await ctx.send("❌ スナップショットが見つからないよ。`!backups` で一覧を確認してね")
+        return
+
+    embed = discord.Embed(title="⚠️ データベース復元",
+                          description=f"{os.path.basename(db_path)} を {name} の内容に戻します。現在のデータは上書きされます。",
+                          color=0xff0000)
+    await ctx.send(embed=embed, view=RestoreView(db_manager, snapshot_path, db_path))
+
+@bot.command()
+async def cachestats(ctx):
+    """応答キャッシュのヒット率を表示"""
+    stats = db_manager.cache.stats()
+
+    embed = discord.Embed(title="🗃️ 応答キャッシュ", color=0x0099ff)
+    embed.add_field(name="ヒット", value=f"{stats['hits']}", inline=True)
+    embed.add_field(name="ミス", value=f"{stats['misses']}", inline=True)
+    embed.add_field(name="ヒット率", value=f"{stats['hit_rate']:.1f}%", inline=True)
+    embed.add_field(name="エントリ数", value=f"{stats['entries']}", inline=True)
+    embed.add_field(name="使用量", value=f"{stats['size'] / 1024:.1f} / {stats['max_bytes'] / 1024:.0f} KB", inline=True)
+    await ctx.send(embed=embed)
+
 @bot.command()
 async def 機構解放(ctx):
     table = [
@@ -271,4 +471,6 @@ async def 機構解放(ctx):
             await ctx.send(f"{ctx.author.mention} ：\n{message}")
             break
 
-bot.run(TOKEN)
+if __name__ == "__main__":
+    Thread(target=run_flask).start()
+    bot.run(TOKEN)
@@ -0,0 +1,85 @@
+import json
+import sys
+from collections import OrderedDict, defaultdict
+from typing import Callable, Dict, Hashable, Iterable
+
+# キャッシュ全体の上限（推定バイト数）
+DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+
+_MISSING = object()
+
+def estimate_size(value) -> int:
+    """キャッシュする値のおおよそのバイト数"""
+    if hasattr(value, "to_dict"):
+        # discord.Embed など
+        return len(json.dumps(value.to_dict(), ensure_ascii=False).encode())
+    if isinstance(value, str):
+        return len(value.encode())
+    if isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    return sys.getsizeof(value)
+
+class ResponseCache:
+    """読み取り専用コマンドの結果キャッシュ
+
+    テーブルごとに世代番号を持ち、書き込み側が bump() で番号を進める。
+    各エントリは作成時に依存テーブルの世代番号を記録し、取得時に一致しなければ破棄する。
+    容量を超えたら最も長く使われていないエントリから捨てる（LRU）。
+    """
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.generations: Dict[str, int] = defaultdict(int)
+        self.entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self, *tables: str):
+        """テーブルへの書き込みを通知し、それに依存するエントリを無効にする"""
+        for table in tables:
+            self.generations[table] += 1
+
+    def get_or_build(self, key: Hashable, tables: Iterable[str], build: Callable):
+        """キャッシュを返す。なければ（または古ければ）build() の結果を保存して返す"""
+        tables = tuple(tables)
+        generation = tuple(self.generations[table] for table in tables)
+
+        entry = self.entries.get(key, _MISSING)
+        if entry is not _MISSING:
+            entry_generation, value, size = entry
+            if entry_generation == generation:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return value
+            self._remove(key)
+
+        self.misses += 1
+        value = build()
+        size = estimate_size(value)
+        if size <= self.max_bytes:
+            self.entries[key] = (generation, value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+        return value
+
+    def _remove(self, key: Hashable):
+        _, _, size = self.entries.pop(key)
+        self.size -= size
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / total * 100) if total > 0 else 0,
+            'entries': len(self.entries),
+            'size': self.size,
+            'max_bytes': self.max_bytes
+        }
@@ -0,0 +1,31 @@
+from typing import List, Optional
+
+# 日本語は単語の区切りがないので、3文字単位で索引するtrigramトークナイザを使う
+FTS_TOKENIZE = "trigram"
+# trigramで検索できる最短の文字数
+MIN_MATCH_LENGTH = 3
+
+def split_terms(query: str) -> List[str]:
+    """検索語を空白（全角含む）で区切る"""
+    return query.replace("　", " ").split()
+
+def build_match_query(query: str) -> Optional[str]:
+    """3文字以上の語からFTS5のMATCH式を作成（すべての語を含む行にマッチ）
+
+    記号がFTS5の構文として解釈されないよう、各語をフレーズとして引用する。
+    3文字以上の語がなければ索引を使えないので None を返す（全件を LIKE で走査はしない）。
+    """
+    terms = [term for term in split_terms(query) if len(term) >= MIN_MATCH_LENGTH]
+    if not terms:
+        return None
+    return " AND ".join('"' + term.replace('"', '""') + '"' for term in terms)
+
+def build_like_patterns(query: str) -> List[str]:
+    """trigramで引けない短い語のLIKEパターン（MATCHで絞り込んだ行に追加で適用する）"""
+    patterns = []
+    for term in split_terms(query):
+        if len(term) >= MIN_MATCH_LENGTH:
+            continue
+        escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        patterns.append(f"%{escaped}%")
+    return patterns